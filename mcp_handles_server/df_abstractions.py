@@ -1,105 +1,249 @@
-import uuid
+import ast
+import asyncio
+import io
+import logging
+import os
+import threading
+import tokenize
+import secrets
 import sqlite3
-import pickle
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial, wraps
+import numexpr
+import numpy as np
 import pandas as pd
+from pandas.api.types import is_integer_dtype, is_numeric_dtype, union_categoricals
 from mcp.server.fastmcp import FastMCP
 
+from mcp_handles_server.serialization import decode_dataframe, encode_dataframe
+
+# Copy-on-Write: derived frames share column buffers until one of them is written to
+pd.set_option("mode.copy_on_write", True)
+# Infer Arrow-backed strings for frames built from Python str data
+pd.options.future.infer_string = True
+
+log = logging.getLogger(__name__)
+
 def get_db_connection():
     try:
-        print("Attempting to connect to database...")
-        conn = sqlite3.connect("handles_db.sqlite", check_same_thread=False)
-        print("Successfully connected to database")
+        log.debug("Attempting to connect to database...")
+        # Autocommit: each statement commits on its own, no explicit commit() calls
+        conn = sqlite3.connect("handles_db.sqlite", check_same_thread=False, isolation_level=None)
+        log.debug("Successfully connected to database")
+        # WAL avoids syncing a rollback journal on every commit
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
         conn.execute('''CREATE TABLE IF NOT EXISTS handles (
             handle TEXT PRIMARY KEY,
             dataframe BLOB
         )''')
-        conn.commit()
+        # Schema handles are also stored one row per column, so clients can
+        # print a schema without decoding its blob
+        conn.execute('''CREATE TABLE IF NOT EXISTS schemas (
+            handle TEXT,
+            position INTEGER,
+            column_name TEXT,
+            dtype TEXT,
+            num_rows INTEGER,
+            PRIMARY KEY (handle, position)
+        )''')
         return conn
     except sqlite3.Error as e:
-        print(f"Database error: {e}")
+        log.error("Database error: %s", e)
         raise
 
-# Initialize database connection
+# Initialize database connection, with one cursor shared by all handle reads and writes
 conn = get_db_connection()
+cursor = conn.cursor()
 
+# Built once from typed arrays so the blocks are the arrays themselves; with
+# Copy-on-Write, queried handles share them and can never write back
 sample_db = {
     "users": pd.DataFrame({
-        "user_id": [1, 2, 3, 4, 5, 6],
-        "name": ["Alice", "Bob", "Charlie", "David", "Eve", "Alice2"],
-        "city": ["New York", "London", "Paris", "London", "Tokyo", "New York"]
+        "user_id": np.array([1, 2, 3, 4, 5, 6], dtype=np.int32),
+        "name": pd.array(["Alice", "Bob", "Charlie", "David", "Eve", "Alice2"], dtype="string[pyarrow]"),
+        "city": pd.array(["New York", "London", "Paris", "London", "Tokyo", "New York"], dtype="string[pyarrow]")
     }),
     "orders": pd.DataFrame({
-        "order_id": [101, 102, 103, 104, 105, 106],
-        "user_id": [1, 2, 1, 3, 5, 2],
-        "product": ["Laptop", "Keyboard", "Mouse", "Monitor", "Webcam", "Desk"],
-        "amount": [1200, 75, 25, 300, 50, 250]
+        "order_id": np.array([101, 102, 103, 104, 105, 106], dtype=np.int32),
+        "user_id": np.array([1, 2, 1, 3, 5, 2], dtype=np.int32),
+        "product": pd.array(["Laptop", "Keyboard", "Mouse", "Monitor", "Webcam", "Desk"], dtype="string[pyarrow]"),
+        "amount": np.array([1200, 75, 25, 300, 50, 250], dtype=np.int64)
     })
 }
 
+# Low-cardinality string columns stored as categoricals on query, so joins and
+# groupings on them work with integer codes instead of hashing strings
+categorical_columns = {
+    "users": ["city"],
+}
+
+# Integer id columns, the join and group keys, downcast to the smallest integer
+# dtype on query so hashing them touches fewer bytes. Measure columns such as
+# amount stay int64: filter arithmetic on them must not overflow.
+id_columns = {
+    "users": ["user_id"],
+    "orders": ["order_id", "user_id"],
+}
+
+# Lookup tables keyed by a unique id. Their frames are indexed by a sorted copy
+# of the key, so joins against them probe the index instead of hashing the key
+key_columns = {
+    "users": "user_id",
+}
+
 handler_mcp = FastMCP("df-abstractions-handler-demo")
 
+# Tools run on this pool rather than on the event loop, so concurrent tool calls
+# overlap in pandas/Arrow code that releases the GIL (merge, groupby, dedup, IPC)
+_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+def _in_executor(fn):
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(_executor, partial(fn, *args, **kwargs))
+    return wrapper
+
+# Guards the shared SQLite cursor and the DataFrame cache across worker threads
+_store_lock = threading.Lock()
+
+# In-memory LRU of decoded DataFrames, checked before SQLite so chained tool
+# calls on the same handle skip deserialization. SQLite remains the store of
+# record (the client reads handles from it).
+_MAX_CACHED_FRAMES = 32
+_MAX_CACHED_BYTES = 256 * 1024 * 1024
+_df_cache: OrderedDict[str, tuple[pd.DataFrame, int]] = OrderedDict()
+_cached_bytes = 0
+
+# Schema handle already produced for a handle; handles never change once saved,
+# so entries stay valid. Bounded like _df_cache, oldest entries evicted first.
+_MAX_SCHEMA_HANDLES = 1024
+_schema_handles: OrderedDict[str, str] = OrderedDict()
+
+def _cache_put(handle: str, df: pd.DataFrame, nbytes: int):
+    # Caller holds _store_lock
+    global _cached_bytes
+    if handle in _df_cache:
+        _cached_bytes -= _df_cache.pop(handle)[1]
+    _df_cache[handle] = (df, nbytes)
+    _cached_bytes += nbytes
+    # Evict least recently used entries, always keeping the newest one
+    while len(_df_cache) > 1 and (len(_df_cache) > _MAX_CACHED_FRAMES or _cached_bytes > _MAX_CACHED_BYTES):
+        _, (_, evicted_bytes) = _df_cache.popitem(last=False)
+        _cached_bytes -= evicted_bytes
+
+def _new_handle() -> str:
+    # Fixed-length hex keys; cheaper to generate than str(uuid.uuid4())
+    return secrets.token_hex(12)
+
 # Helper functions to persist DataFrames
 def save_handle(handle: str, df: pd.DataFrame):
-    print(f"Saving handle {handle} to database...")
-    df_blob = pickle.dumps(df)
-    # Get a cursor for this operation
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR REPLACE INTO handles (handle, dataframe) VALUES (?, ?)", (handle, df_blob))
-    conn.commit()
-    cursor.close()
-    print(f"Successfully saved handle {handle}")
-    # Verify the save worked
-    verify = load_handle(handle)
-    if verify is not None:
-        print(f"Verified handle {handle} was saved correctly")
-    else:
-        print(f"WARNING: Could not verify handle {handle} was saved")
+    log.debug("Saving handle %s to database...", handle)
+    nbytes = int(df.memory_usage(deep=True).sum())
+    df_blob = encode_dataframe(df)
+    with _store_lock:
+        _cache_put(handle, df, nbytes)
+        cursor.execute("INSERT OR REPLACE INTO handles (handle, dataframe) VALUES (?, ?)", (handle, df_blob))
+    log.debug("Successfully saved handle %s", handle)
+
+def save_schema(handle: str, schema_info: pd.DataFrame) -> str:
+    """
+    Save the schema frame of a handle as a new handle, and return it.
 
+    The blob, the per-column rows and the _schema_handles entry are written
+    under one lock acquisition, so concurrent calls for the same handle agree
+    on a single schema handle and never return one that is not yet stored.
+    """
+    nbytes = int(schema_info.memory_usage(deep=True).sum())
+    df_blob = encode_dataframe(schema_info)
+    with _store_lock:
+        schema_handle = _schema_handles.get(handle)
+        if schema_handle is not None:
+            return schema_handle
+        schema_handle = _new_handle()
+        rows = [
+            (schema_handle, position, str(column), dtype, int(num_rows))
+            for position, (column, dtype, num_rows) in enumerate(
+                zip(schema_info['column'], schema_info['dtype'], schema_info['num_rows'])
+            )
+        ]
+        _cache_put(schema_handle, schema_info, nbytes)
+        cursor.execute("INSERT OR REPLACE INTO handles (handle, dataframe) VALUES (?, ?)", (schema_handle, df_blob))
+        cursor.executemany(
+            "INSERT OR REPLACE INTO schemas (handle, position, column_name, dtype, num_rows) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        _schema_handles[handle] = schema_handle
+        while len(_schema_handles) > _MAX_SCHEMA_HANDLES:
+            _schema_handles.popitem(last=False)
+    return schema_handle
 
 def load_handle(handle: str):
-    print(f"Loading handle {handle} from database...")
+    with _store_lock:
+        cached = _df_cache.get(handle)
+        if cached is not None:
+            _df_cache.move_to_end(handle)
+            return cached[0]
+    log.debug("Loading handle %s from database...", handle)
     try:
-        # Get a cursor for this operation
-        cursor = conn.cursor()
-        cursor.execute("SELECT dataframe FROM handles WHERE handle = ?", (handle,))
-        result = cursor.fetchone()
-        cursor.close()
+        with _store_lock:
+            cursor.execute("SELECT dataframe FROM handles WHERE handle = ?", (handle,))
+            result = cursor.fetchone()
         if result:
-            print(f"Successfully loaded handle {handle}")
-            return pickle.loads(result[0])
+            log.debug("Successfully loaded handle %s", handle)
+            df = decode_dataframe(result[0])
+            nbytes = int(df.memory_usage(deep=True).sum())
+            with _store_lock:
+                _cache_put(handle, df, nbytes)
+            return df
         else:
-            print(f"Handle {handle} not found in database")
-            # List all handles in database for debugging
-            cursor = conn.cursor()
-            cursor.execute("SELECT handle FROM handles")
-            handles = cursor.fetchall()
-            cursor.close()
-            print(f"Available handles in database: {[h[0] for h in handles]}")
+            log.debug("Handle %s not found in database", handle)
             return None
     except Exception as e:
-        print(f"Error loading handle {handle}: {e}")
+        log.error("Error loading handle %s: %s", handle, e)
         raise
 
 @handler_mcp.tool()
+@_in_executor
 def get_db_tables() -> list[str]:
     """
     Get the names of all tables in the database.
     """
-    return sample_db.keys()
+    return list(sample_db)
+
+def _downcast_ids(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    """
+    Shrink the given integer columns to the smallest dtype holding their values.
+    """
+    for col in columns:
+        if is_integer_dtype(df[col].dtype):
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
 
 @handler_mcp.tool()
+@_in_executor
 def query_database(table_name: str) -> str:
     """
     Query a table in the database and return a handle to the DataFrame.
     """
     if table_name in sample_db:
-        handle = str(uuid.uuid4())
-        save_handle(handle, sample_db[table_name].copy())
+        handle = _new_handle()
+        # Shallow copy: a new frame object whose columns are copied only if written to
+        df = _downcast_ids(sample_db[table_name].copy(deep=False), id_columns.get(table_name, []))
+        for col in categorical_columns.get(table_name, []):
+            df[col] = df[col].astype("category")
+        if table_name in key_columns:
+            df = df.set_index(key_columns[table_name], drop=False).sort_index().rename_axis(None)
+        save_handle(handle, df)
         return handle
     else:
         return f"Error: Table '{table_name}' not found."
 
 @handler_mcp.tool()
+@_in_executor
 def combine_columns(handle: str, col1_name: str, col2_name: str, new_col_name: str, sep: str = " ") -> str:
     df = load_handle(handle)
     if df is None:
@@ -108,12 +252,61 @@ def combine_columns(handle: str, col1_name: str, col2_name: str, new_col_name: s
     if col1_name not in df or col2_name not in df:
         return f"Error: Column(s) not found."
 
-    df[new_col_name] = df[col1_name].astype(str) + sep + df[col2_name].astype(str)
-    save_handle(handle, df)
-    return handle
+    # str.cat joins both columns in a single pass instead of materializing
+    # each side as str and then concatenating
+    combined = df[col1_name].astype("string[pyarrow]").str.cat(df[col2_name].astype("string[pyarrow]"), sep=sep, na_rep="")
+    # The result gets its own handle: stored handles never change, so clients
+    # can cache what they have already fetched
+    df = df.assign(**{new_col_name: combined})
+    new_handle = _new_handle()
+    save_handle(new_handle, df)
+    return new_handle
+
+def _align_categories(df1: pd.DataFrame, df2: pd.DataFrame, column: str):
+    """
+    Give a categorical join key the same categories on both sides, so the
+    merge matches on category codes rather than falling back to the values.
+    """
+    left, right = df1[column], df2[column]
+    if not (isinstance(left.dtype, pd.CategoricalDtype) and isinstance(right.dtype, pd.CategoricalDtype)):
+        return df1, df2
+    if left.dtype == right.dtype:
+        return df1, df2
+    categories = union_categoricals([left, right]).categories
+    df1 = df1.assign(**{column: left.cat.set_categories(categories)})
+    df2 = df2.assign(**{column: right.cat.set_categories(categories)})
+    return df1, df2
+
+def _is_key_indexed(df: pd.DataFrame, column: str) -> bool:
+    """
+    Whether the index of df is a sorted, unique copy of `column`, as set up
+    by query_database for lookup tables (and kept by row filters).
+    """
+    index = df.index
+    return (
+        index.is_monotonic_increasing
+        and index.is_unique
+        and index.dtype == df[column].dtype
+        and bool((index.to_numpy() == df[column].to_numpy()).all())
+    )
 
 @handler_mcp.tool()
-def join_dataframes(handle1: str, handle2: str, on_column: str, how: str = 'inner') -> str:
+@_in_executor
+def join_dataframes(handle1: str, handle2: str, on_column: str, how: str = 'inner', cardinality: str = None) -> str:
+    """
+    Join two DataFrames on a common column.
+
+    Args:
+        handle1: The handle of the left DataFrame
+        handle2: The handle of the right DataFrame
+        on_column: Column present in both DataFrames to join on
+        how: Type of join: 'inner', 'left', 'right' or 'outer'
+        cardinality: Optional expected key cardinality, checked during the join:
+                  'one_to_one', 'one_to_many', 'many_to_one' or 'many_to_many'
+
+    Returns:
+        New handle for the joined DataFrame
+    """
     df1 = load_handle(handle1)
     df2 = load_handle(handle2)
 
@@ -123,12 +316,34 @@ def join_dataframes(handle1: str, handle2: str, on_column: str, how: str = 'inne
     if on_column not in df1 or on_column not in df2:
         return "Error: Join column not found."
 
-    joined_df = pd.merge(df1, df2, on=on_column, how=how)
-    new_handle = str(uuid.uuid4())
+    df1, df2 = _align_categories(df1, df2, on_column)
+
+    # An inner join can only match left keys inside the right side's key range,
+    # so trim the left side before the merge builds its hash table. Missing keys
+    # are kept: merge matches them to missing keys on the other side.
+    if how == 'inner' and is_numeric_dtype(df1[on_column]) and is_numeric_dtype(df2[on_column]):
+        left_keys = df1[on_column]
+        df1 = df1[left_keys.between(df2[on_column].min(), df2[on_column].max()) | left_keys.isna()]
+
+    try:
+        if how in ('inner', 'left') and _is_key_indexed(df2, on_column):
+            # Probe the right side's sorted key index instead of hashing its key column;
+            # the key column itself comes from the left side, as with on=
+            joined_df = pd.merge(
+                df1, df2.drop(columns=on_column), left_on=on_column, right_index=True,
+                how=how, sort=False, suffixes=("_x", "_y"), validate=cardinality,
+            ).reset_index(drop=True)
+        else:
+            joined_df = pd.merge(df1, df2, on=on_column, how=how, sort=False, suffixes=("_x", "_y"), validate=cardinality)
+    except Exception as e:
+        return f"Error in joining: {str(e)}"
+
+    new_handle = _new_handle()
     save_handle(new_handle, joined_df)
     return new_handle
 
 @handler_mcp.tool()
+@_in_executor
 def select_columns(handle: str, columns: list) -> str:
     df = load_handle(handle)
     if df is None:
@@ -138,49 +353,159 @@ def select_columns(handle: str, columns: list) -> str:
     if missing_cols:
         return f"Error: Columns {missing_cols} not found."
 
-    new_df = df[columns].copy()
-    new_handle = str(uuid.uuid4())
+    new_df = df[columns]
+    new_handle = _new_handle()
     save_handle(new_handle, new_df)
     return new_handle
 
+class _NumExprRewriter(ast.NodeTransformer):
+    """
+    Rewrite DataFrame.query syntax into numexpr syntax: `and`/`or`/`not`
+    become `&`/`|`/`~`, and chained comparisons are split into pairs.
+    """
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        expr = node.values[0]
+        for value in node.values[1:]:
+            expr = ast.BinOp(left=expr, op=op, right=value)
+        return expr
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        operands = [node.left, *node.comparators]
+        expr = None
+        for left, op, right in zip(operands, node.ops, operands[1:]):
+            pair = ast.Compare(left=left, ops=[op], comparators=[right])
+            expr = pair if expr is None else ast.BinOp(left=expr, op=ast.BitAnd(), right=pair)
+        return expr
+
+# Everything else (strings, calls, attributes, `in`, @variables, ...) is left to df.query
+_NUMEXPR_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Name, ast.Load, ast.Constant,
+    ast.BitAnd, ast.BitOr, ast.Invert, ast.UAdd, ast.USub,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+@lru_cache(maxsize=128)
+def _translate_filter(filter_expr: str):
+    """
+    Translate a filter expression to numexpr syntax, returning the translated
+    expression and the names it references, or None if numexpr can't run it.
+    """
+    try:
+        # DataFrame.query gives `&` and `|` the precedence of `and` and `or`
+        # (so `a > 1 & b < 2` groups as two comparisons); parse them the same way
+        tokens = [
+            (tokenize.NAME, "and" if tok.string == "&" else "or")
+            if tok.type == tokenize.OP and tok.string in ("&", "|") else (tok.type, tok.string)
+            for tok in tokenize.generate_tokens(io.StringIO(filter_expr).readline)
+        ]
+        tree = _NumExprRewriter().visit(ast.parse(tokenize.untokenize(tokens), mode="eval"))
+    except (SyntaxError, tokenize.TokenError):
+        return None
+    for node in ast.walk(tree):
+        if not isinstance(node, _NUMEXPR_NODES):
+            return None
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            return None
+    names = tuple(sorted({node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}))
+    return ast.unparse(tree), names
+
+_numexpr_lock = threading.Lock()
+
+@lru_cache(maxsize=128)
+def _compile_filter(expr: str, signature: tuple):
+    try:
+        return numexpr.NumExpr(expr, signature=signature)
+    except Exception:
+        return None
+
+def _numexpr_mask(df: pd.DataFrame, filter_expr: str):
+    """
+    Evaluate filter_expr over the numeric columns of df with a cached numexpr
+    program. Returns the boolean row mask, or None when df.query is needed.
+    """
+    translated = _translate_filter(filter_expr)
+    if translated is None:
+        return None
+    expr, names = translated
+    if not names:
+        return None
+
+    arrays = []
+    for name in names:
+        if name not in df.columns:
+            return None
+        col = df[name]
+        if not isinstance(col, pd.Series) or not isinstance(col.dtype, np.dtype):
+            return None
+        if col.dtype.kind not in "biuf" or (col.dtype.kind == "u" and col.dtype.itemsize == 8):
+            return None
+        arrays.append(col.to_numpy())
+
+    signature = tuple((name, numexpr.necompiler.getType(array)) for name, array in zip(names, arrays))
+    program = _compile_filter(expr, signature)
+    if program is None:
+        return None
+    # A compiled program runs on numexpr's own thread pool; don't enter it twice at once
+    with _numexpr_lock:
+        mask = program(*arrays)
+    if mask.dtype != np.bool_ or mask.shape != (len(df),):
+        return None
+    return mask
+
 @handler_mcp.tool()
+@_in_executor
 def filter_rows(handle: str, filter_expr: str) -> str:
     df = load_handle(handle)
     if df is None:
         return f"Error: Handle '{handle}' not found."
 
     try:
-        filtered_df = df.query(filter_expr)
+        mask = _numexpr_mask(df, filter_expr)
+        filtered_df = df.query(filter_expr) if mask is None else df[mask]
     except Exception as e:
         return f"Error in filtering rows: {str(e)}"
 
-    new_handle = str(uuid.uuid4())
+    new_handle = _new_handle()
     save_handle(new_handle, filtered_df)
     return new_handle
 
 @handler_mcp.tool()
+@_in_executor
 def drop_columns(handle: str, columns: list) -> str:
     df = load_handle(handle)
     if df is None:
         return f"Error: Handle '{handle}' not found."
 
     new_df = df.drop(columns=columns, errors='ignore')
-    new_handle = str(uuid.uuid4())
+    new_handle = _new_handle()
     save_handle(new_handle, new_df)
     return new_handle
 
 @handler_mcp.tool()
+@_in_executor
 def remove_duplicates(handle: str) -> str:
     df = load_handle(handle)
     if df is None:
         return f"Error: Handle '{handle}' not found."
 
     new_df = df.drop_duplicates()
-    new_handle = str(uuid.uuid4())
+    new_handle = _new_handle()
     save_handle(new_handle, new_df)
     return new_handle
 
 @handler_mcp.tool()
+@_in_executor
 def distinct_rows(handle: str, columns: list = None) -> str:
     df = load_handle(handle)
     if df is None:
@@ -190,31 +515,41 @@ def distinct_rows(handle: str, columns: list = None) -> str:
         missing_cols = [col for col in columns if col not in df.columns]
         if missing_cols:
             return f"Error: Columns {missing_cols} not found."
-        new_df = df[columns].drop_duplicates()
+        if len(columns) == 1:
+            # pd.unique hashes the single column directly, no intermediate frame
+            new_df = pd.DataFrame({columns[0]: pd.unique(df[columns[0]].array)})
+        else:
+            new_df = df.drop_duplicates(subset=columns).loc[:, columns]
     else:
         new_df = df.drop_duplicates()
         
-    new_handle = str(uuid.uuid4())
+    new_handle = _new_handle()
     save_handle(new_handle, new_df)
     return new_handle
 
 @handler_mcp.tool()
+@_in_executor
 def get_schema(handle: str) -> str:
+    with _store_lock:
+        schema_handle = _schema_handles.get(handle)
+        if schema_handle is not None:
+            _schema_handles.move_to_end(handle)
+            return schema_handle
+
     df = load_handle(handle)
     if df is None:
         return f"Error: Handle '{handle}' not found."
-    
+
     schema_info = pd.DataFrame({
-        'column': df.columns.tolist(),
-        'dtype': df.dtypes.astype(str).values.tolist(),
+        'column': df.columns.to_numpy(),
+        'dtype': df.dtypes.astype(str).to_numpy(),
+        'num_rows': np.full(len(df.columns), len(df), dtype=np.int64),
     })
-    schema_info['num_rows'] = len(df)
-    
-    new_handle = str(uuid.uuid4())
-    save_handle(new_handle, schema_info)
-    return new_handle
+
+    return save_schema(handle, schema_info)
 
 @handler_mcp.tool()
+@_in_executor
 def group_by(handle: str, group_columns: list, agg_dict: dict) -> str:
     """
     Group DataFrame by specified columns and apply aggregation functions.
@@ -223,7 +558,9 @@ def group_by(handle: str, group_columns: list, agg_dict: dict) -> str:
         handle: The handle of the DataFrame to group
         group_columns: List of columns to group by
         agg_dict: Dictionary mapping column names to aggregation functions
-                 e.g., {"amount": "sum", "order_id": "count"}
+                 e.g., {"amount": "sum", "order_id": "count"}. A list of functions
+                 yields one "<column>_<function>" column per function,
+                 e.g., {"amount": ["sum", "mean"]} -> amount_sum, amount_mean
     
     Returns:
         New handle for the grouped DataFrame
@@ -242,9 +579,21 @@ def group_by(handle: str, group_columns: list, agg_dict: dict) -> str:
     if missing_agg_cols:
         return f"Error: Aggregation columns {missing_agg_cols} not found."
     
+    # Named aggregations keep flat column names and go straight to the
+    # per-function kernels instead of the generic dict dispatch
+    agg_kwargs = {}
+    for col, funcs in agg_dict.items():
+        if isinstance(funcs, list):
+            for func in funcs:
+                agg_kwargs[f"{col}_{func}"] = pd.NamedAgg(column=col, aggfunc=func)
+        else:
+            agg_kwargs[col] = pd.NamedAgg(column=col, aggfunc=funcs)
+
     try:
-        grouped_df = df.groupby(group_columns, as_index=False).agg(agg_dict)
-        new_handle = str(uuid.uuid4())
+        # observed=True: only emit groups for categories that are actually present;
+        # sort=False: keep groups in order of appearance rather than sorting the keys
+        grouped_df = df.groupby(group_columns, as_index=False, observed=True, sort=False, dropna=False).agg(**agg_kwargs)
+        new_handle = _new_handle()
         save_handle(new_handle, grouped_df)
         return new_handle
     except Exception as e:
@@ -3,47 +3,138 @@ This module contains a simple MCP server that gives a model the ability to run g
 """
 
 import io
+import logging
+import threading
+import secrets
 import traceback
-import uuid
+from functools import lru_cache
 from typing import Any, Dict, List
 
+import numpy as np
+import orjson
 import pandas as pd
+import pyarrow as pa
 from mcp.server.fastmcp import FastMCP
 
+# Let handles share column data instead of taking defensive deep copies
+pd.set_option("mode.copy_on_write", True)
+# Keep strings Arrow-backed in frames produced by the executed code
+pd.options.future.infer_string = True
+
+log = logging.getLogger(__name__)
+
 # --- Security Warning ---
-print("\n" + "="*60)
-print("WARNING: This server uses exec() to run arbitrary Python code.")
-print("This is extremely dangerous and should NOT be used in production")
-print("without proper sandboxing and security reviews.")
-print("This is for demonstration purposes ONLY.")
-print("="*60 + "\n")
+log.warning(
+    "\n" + "="*60 + "\n"
+    "WARNING: This server uses exec() to run arbitrary Python code.\n"
+    "This is extremely dangerous and should NOT be used in production\n"
+    "without proper sandboxing and security reviews.\n"
+    "This is for demonstration purposes ONLY.\n"
+    + "="*60
+)
 # --- End Security Warning ---
 
 # --- In-memory storage for our demo ---
 # Simulate a database with a couple of tables
 sample_db: Dict[str, pd.DataFrame] = {
     "users": pd.DataFrame({
-        "user_id": [1, 2, 3, 4, 5],
-        "name": ["Alice", "Bob", "Charlie", "David", "Eve"],
-        "city": ["New York", "London", "Paris", "London", "Tokyo"]
+        "user_id": np.array([1, 2, 3, 4, 5], dtype=np.int32),
+        "name": pd.array(["Alice", "Bob", "Charlie", "David", "Eve"], dtype="string[pyarrow]"),
+        "city": pd.array(["New York", "London", "Paris", "London", "Tokyo"], dtype="string[pyarrow]")
     }),
     "orders": pd.DataFrame({
-        "order_id": [101, 102, 103, 104, 105, 106],
-        "user_id": [1, 2, 1, 3, 5, 2],
-        "product": ["Laptop", "Keyboard", "Mouse", "Monitor", "Webcam", "Desk"],
-        "amount": [1200, 75, 25, 300, 50, 250]
+        "order_id": np.array([101, 102, 103, 104, 105, 106], dtype=np.int32),
+        "user_id": np.array([1, 2, 1, 3, 5, 2], dtype=np.int32),
+        "product": pd.array(["Laptop", "Keyboard", "Mouse", "Monitor", "Webcam", "Desk"], dtype="string[pyarrow]"),
+        "amount": np.array([1200, 75, 25, 300, 50, 250], dtype=np.int64)
     })
 }
 
 # Store the DataFrames generated during the session, mapped by handle
 data_handles: Dict[str, pd.DataFrame] = {}
 
+def _new_handle() -> str:
+    # 24 hex characters from the OS CSPRNG, without building a UUID object
+    return secrets.token_hex(12)
+
+# --- Output limits for materialize_dataframe ---
+# Upper bound on the characters returned into the model context
+_MAX_OUTPUT_CHARS = 64 * 1024
+# Rows rendered to estimate how many rows of a structured format fit the limit
+_PROBE_ROWS = 100
+# Widest cell rendered by the *_string formats; longer values are elided
+_MAX_COLWIDTH = 64
+# One reusable CSV buffer per worker thread
+_csv_buffers = threading.local()
+# Row sampling for 'sample_string'; Generator.choice draws without building a full permutation
+_rng = np.random.default_rng()
+_LARGE_SAMPLE_ROWS = 10**6
+
+def _csv_buffer() -> io.StringIO:
+    buffer = getattr(_csv_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _csv_buffers.buffer = io.StringIO()
+    buffer.seek(0)
+    buffer.truncate()
+    return buffer
+
+def _json_split(df: pd.DataFrame) -> str:
+    # Build the row lists straight from the Arrow columns and let orjson encode
+    # them, rather than going through pandas' split-orient JSON writer
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        payload = {
+            "columns": df.columns.tolist(),
+            "index": df.index.tolist(),
+            "data": list(zip(*(column.to_pylist() for column in table.columns))),
+        }
+        return orjson.dumps(payload).decode()
+    except (pa.ArrowException, TypeError, ValueError):
+        # Mixed object columns, duplicate names or values orjson can't encode
+        return df.to_json(orient="split")
+
+def _to_csv(df: pd.DataFrame) -> str:
+    csv_buffer = _csv_buffer()
+    df.to_csv(csv_buffer, index=False)
+    return csv_buffer.getvalue()
+
+# Formats that must stay parseable, so they are cut at a row boundary rather than a character
+_STRUCTURED_FORMATS = {
+    "json_records": lambda df: df.to_json(orient="records"),
+    "json_split": _json_split,
+    "csv": _to_csv,
+}
+
+def _fit_rows(df: pd.DataFrame, render) -> str:
+    rows = len(df)
+    if rows > _PROBE_ROWS:
+        # Estimate the row count from a small head, so a large frame is never rendered whole
+        probe = render(df.head(_PROBE_ROWS))
+        rows = min(rows, max(1, _PROBE_ROWS * _MAX_OUTPUT_CHARS // max(len(probe), 1)))
+    output = render(df.head(rows))
+    while len(output) > _MAX_OUTPUT_CHARS and rows > 0:
+        # Scale the row count by how far over the limit the output is, always dropping at least one row
+        rows = min(rows - 1, int(rows * _MAX_OUTPUT_CHARS / len(output) * 0.95))
+        output = render(df.head(rows))
+    if rows < len(df):
+        output += f"\n... (truncated to {rows} of {len(df)} rows)"
+    return output
+
+# --- Code execution ---
+# Names available to executed code; each call gets its own shallow copy
+_EXEC_GLOBALS: Dict[str, Any] = {'pd': pd, 'np': np}
+
+@lru_cache(maxsize=256)
+def _compile_exec(code: str):
+    # Retried snippets skip tokenizing, parsing and compiling
+    return compile(code, "<mcp-exec>", "exec")
+
 # --- MCP Server Setup ---
 mcp = FastMCP(
     "generic-pandas-handler-demo",
 )
 
-print("Generic Pandas Server starting...")
+log.info("Generic Pandas Server starting...")
 
 # --- Tool Definitions ---
 
@@ -58,16 +149,16 @@ def query_database(table_name: str) -> str:
     Returns:
         A unique handle (string) for the loaded DataFrame, or an error message.
     """
-    print(f"[Tool: query_database] Args: table_name='{table_name}'")
+    log.debug("[Tool: query_database] Args: table_name='%s'", table_name)
     if table_name in sample_db:
-        # Return a copy to avoid modifying the original 'db'
-        df_copy = sample_db[table_name].copy()
-        handle = str(uuid.uuid4())
+        # Shallow copy: with Copy-on-Write, writes never reach the original 'db'
+        df_copy = sample_db[table_name].copy(deep=False)
+        handle = _new_handle()
         data_handles[handle] = df_copy
-        print(f"  -> Generated handle {handle} for table '{table_name}', shape: {df_copy.shape}")
+        log.debug("  -> Generated handle %s for table '%s', shape: %s", handle, table_name, df_copy.shape)
         return handle
     else:
-        print(f"  -> Error: Table '{table_name}' not found.")
+        log.debug("  -> Error: Table '%s' not found.", table_name)
         return f"Error: Table '{table_name}' not found."
 
 @mcp.tool()
@@ -86,7 +177,7 @@ def execute_pandas_code(
               corresponding DataFrames. It should assign results to variables
               named in `output_aliases`.
         input_handles: A dictionary mapping variable names (aliases) to use in the code
-                       to the corresponding DataFrame handles. Example: {"df1": "handle_uuid_1", "users_df": "handle_uuid_2"}
+                       to the corresponding DataFrame handles. Example: {"df1": "handle_1", "users_df": "handle_2"}
         output_aliases: A list of variable names expected to hold DataFrame results
                         after the code execution. Example: ["result_df", "summary_df"]
 
@@ -94,29 +185,30 @@ def execute_pandas_code(
         A dictionary mapping the output aliases to their new handles if successful,
         or a dictionary containing an 'error' key with an error message.
     """
-    print(f"[Tool: execute_pandas_code] Input Handles: {input_handles}, Output Aliases: {output_aliases}")
-    print(f"  Code to execute:\n---\n{code}\n---")
+    log.debug("[Tool: execute_pandas_code] Input Handles: %s, Output Aliases: %s", input_handles, output_aliases)
+    log.debug("  Code to execute:\n---\n%s\n---", code)
 
     local_vars: Dict[str, Any] = {}
-    global_vars: Dict[str, Any] = {'pd': pd} # Make pandas available to the code
+    global_vars: Dict[str, Any] = dict(_EXEC_GLOBALS) # Make pandas and numpy available to the code
 
     # Load input DataFrames into the local execution context
     for alias, handle in input_handles.items():
         if handle not in data_handles:
             error_msg = f"Error: Input handle '{handle}' (alias '{alias}') not found."
-            print(f"  -> {error_msg}")
+            log.debug("  -> %s", error_msg)
             return {"error": error_msg}
-        # Pass copies to prevent unexpected modification of originals via reference
-        local_vars[alias] = data_handles[handle].copy()
-        print(f"  Mapped alias '{alias}' to handle '{handle}' (shape: {local_vars[alias].shape})")
+        # Shallow copies keep the code's writes from reaching the originals;
+        # Copy-on-Write only duplicates the columns it actually assigns to
+        local_vars[alias] = data_handles[handle].copy(deep=False)
+        log.debug("  Mapped alias '%s' to handle '%s' (shape: %s)", alias, handle, local_vars[alias].shape)
 
     # Execute the code - THIS IS THE DANGEROUS PART
     try:
-        exec(code, global_vars, local_vars)
-        print("  Code execution completed.")
+        exec(_compile_exec(code), global_vars, local_vars)
+        log.debug("  Code execution completed.")
     except Exception as e:
         error_msg = f"Error during code execution: {type(e).__name__}: {e}\n{traceback.format_exc()}"
-        print(f"  -> {error_msg}")
+        log.debug("  -> %s", error_msg)
         return {"error": error_msg}
 
     # Process outputs
@@ -124,21 +216,21 @@ def execute_pandas_code(
     for alias in output_aliases:
         if alias not in local_vars:
             error_msg = f"Error: Expected output alias '{alias}' not found after code execution."
-            print(f"  -> {error_msg}")
+            log.debug("  -> %s", error_msg)
             return {"error": error_msg}
 
         result_df = local_vars[alias]
         if not isinstance(result_df, pd.DataFrame):
             error_msg = f"Error: Output alias '{alias}' did not result in a DataFrame (type: {type(result_df).__name__})."
-            print(f"  -> {error_msg}")
+            log.debug("  -> %s", error_msg)
             return {"error": error_msg}
 
-        new_handle = str(uuid.uuid4())
+        new_handle = _new_handle()
         data_handles[new_handle] = result_df # Store the new DataFrame
         output_handles[alias] = new_handle
-        print(f"  Generated handle '{new_handle}' for output alias '{alias}' (shape: {result_df.shape})")
+        log.debug("  Generated handle '%s' for output alias '%s' (shape: %s)", new_handle, alias, result_df.shape)
 
-    print(f"  -> Returning output handles: {output_handles}")
+    log.debug("  -> Returning output handles: %s", output_handles)
     return output_handles
 
 
@@ -166,10 +258,10 @@ def materialize_dataframe(
     Returns:
         The materialized data as a string, or an error message.
     """
-    print(f"[Tool: materialize_dataframe] Args: handle='{handle}', format='{format}', n={n}")
+    log.debug("[Tool: materialize_dataframe] Args: handle='%s', format='%s', n=%s", handle, format, n)
     if handle not in data_handles:
         error_msg = f"Error: Handle '{handle}' not found."
-        print(f"  -> {error_msg}")
+        log.debug("  -> %s", error_msg)
         return error_msg
 
     if not isinstance(n, int) or n <= 0:
@@ -180,39 +272,43 @@ def materialize_dataframe(
 
     try:
         if format == "head_string":
-            output_str = df.head(n).to_string()
+            output_str = df.head(n).to_string(max_colwidth=_MAX_COLWIDTH)
         elif format == "tail_string":
-             output_str = df.tail(n).to_string()
+             output_str = df.tail(n).to_string(max_colwidth=_MAX_COLWIDTH)
         elif format == "sample_string":
-             output_str = df.sample(min(n, len(df))).to_string() # Sample up to n or df length
+             n_sample = min(n, len(df)) # Sample up to n or df length
+             if len(df) > _LARGE_SAMPLE_ROWS:
+                 # Skip DataFrame.sample's weight/axis handling on very large frames
+                 sampled = df.iloc[_rng.choice(len(df), size=n_sample, replace=False)]
+             else:
+                 sampled = df.sample(n=n_sample, random_state=_rng)
+             output_str = sampled.to_string(max_colwidth=_MAX_COLWIDTH)
         elif format == "full_string":
              # Add safety limit for demo purposes
              MAX_ROWS_FULL = 1000
              if len(df) > MAX_ROWS_FULL:
-                 print(f"  Warning: 'full_string' requested for large DF ({len(df)} rows). Truncating to {MAX_ROWS_FULL} rows.")
-                 output_str = df.head(MAX_ROWS_FULL).to_string() + f"\n... (truncated to {MAX_ROWS_FULL} rows)"
+                 log.warning("  Warning: 'full_string' requested for large DF (%d rows). Truncating to %d rows.", len(df), MAX_ROWS_FULL)
+                 output_str = df.head(MAX_ROWS_FULL).to_string(max_colwidth=_MAX_COLWIDTH) + f"\n... (truncated to {MAX_ROWS_FULL} rows)"
              else:
-                output_str = df.to_string()
-        elif format == "json_records":
-             output_str = df.to_json(orient="records", indent=2)
-        elif format == "json_split":
-             output_str = df.to_json(orient="split", indent=2)
-        elif format == "csv":
-            # Use io.StringIO to capture CSV output as string
-            csv_buffer = io.StringIO()
-            df.to_csv(csv_buffer, index=False)
-            output_str = csv_buffer.getvalue()
+                output_str = df.to_string(max_colwidth=_MAX_COLWIDTH)
+        elif format in _STRUCTURED_FORMATS:
+            output_str = _fit_rows(df, _STRUCTURED_FORMATS[format])
         else:
             error_msg = f"Error: Invalid format '{format}'. Valid formats are: head_string, tail_string, sample_string, full_string, json_records, json_split, csv."
-            print(f"  -> {error_msg}")
+            log.debug("  -> %s", error_msg)
             return error_msg
 
-        print(f"  -> Materialized {len(output_str)} chars in format '{format}'. Preview:\n{output_str[:200]}...")
+        # Text renderings can be cut anywhere; structured formats were already limited by rows
+        if format not in _STRUCTURED_FORMATS and len(output_str) > _MAX_OUTPUT_CHARS:
+            output_str = output_str[:_MAX_OUTPUT_CHARS] + f"\n... (truncated to {_MAX_OUTPUT_CHARS} characters)"
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("  -> Materialized %d chars in format '%s'. Preview:\n%s...", len(output_str), format, output_str[:200])
         return output_str
 
     except Exception as e:
         error_msg = f"Error materializing DataFrame '{handle}' in format '{format}': {str(e)}"
-        print(f"  -> {error_msg}\n{traceback.format_exc()}")
+        log.exception("  -> %s", error_msg)
         return error_msg
 
 @mcp.tool()
@@ -226,18 +322,18 @@ def get_shape(handle: str) -> str:
     Returns:
         A string representation of the shape (e.g., "(100, 5)"), or an error message.
     """
-    print(f"[Tool: get_shape] Args: handle='{handle}'")
+    log.debug("[Tool: get_shape] Args: handle='%s'", handle)
     if handle not in data_handles:
         error_msg = f"Error: Handle '{handle}' not found."
-        print(f"  -> {error_msg}")
+        log.debug("  -> %s", error_msg)
         return error_msg
 
     df = data_handles[handle]
     shape_str = str(df.shape)
-    print(f"  -> Returning shape: {shape_str}")
+    log.debug("  -> Returning shape: %s", shape_str)
     return shape_str
 
 # --- Run the server ---
 if __name__ == "__main__":
     mcp.run() # Runs using stdio by default
-    print("Generic Pandas Server finished.")
\ No newline at end of file
+    log.info("Generic Pandas Server finished.")
\ No newline at end of file
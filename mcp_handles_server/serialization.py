@@ -0,0 +1,130 @@
+"""
+Encoding of DataFrames for the handles table.
+
+DataFrames are stored as Arrow IPC streams rather than pickles: the columnar
+buffers are written as-is, and reading them back wraps the stored bytes
+instead of rebuilding a Python object graph cell by cell.
+
+Every blob starts with a four-byte format tag (b'ARR1' for Arrow, b'PKL5' for
+pickle) that selects its decoder. Frames Arrow cannot represent (duplicate
+column names, mixed-type object columns) are stored as protocol 5 pickles.
+Untagged blobs are pickles written before the tag was introduced; they are
+recognised by the PROTO opcode every protocol 2+ pickle starts with.
+"""
+
+import io
+import pickle
+
+import pyarrow as pa
+
+ARROW_TAG = b"ARR1"
+PICKLE_TAG = b"PKL5"
+_TAG_SIZE = 4
+_LEGACY_PICKLE = b"\x80"
+
+# Tables at least this large are written with LZ4-compressed IPC buffers:
+# fewer bytes through SQLite outweigh the decompression. Readers need no
+# changes, since IPC streams record each buffer's codec.
+_COMPRESSION_MIN_BYTES = 1024 * 1024
+_COMPRESSED = pa.ipc.IpcWriteOptions(compression="lz4")
+
+
+def encode_dataframe(df) -> pa.Buffer:
+    """
+    Serialize a DataFrame to a tagged Arrow IPC stream, or a tagged pickle.
+
+    The returned Arrow buffer supports the buffer protocol, so it can be bound
+    to a SQLite BLOB parameter directly without first being copied to bytes.
+    """
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowException, ValueError):
+        return _encode_pickle(df)
+    options = _COMPRESSED if table.nbytes >= _COMPRESSION_MIN_BYTES else None
+    sink = pa.BufferOutputStream()
+    sink.write(ARROW_TAG)
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _encode_pickle(df) -> pa.Buffer:
+    # Protocol 5 writes the ndarray blocks as raw buffers instead of
+    # re-encoding them through intermediate bytes objects
+    sink = pa.BufferOutputStream()
+    sink.write(PICKLE_TAG)
+    pickle.dump(df, sink, protocol=5)
+    return sink.getvalue()
+
+
+def _decode_arrow(payload: memoryview):
+    # py_buffer wraps the bytes without copying; column buffers are sliced from it
+    reader = pa.ipc.open_stream(pa.py_buffer(payload))
+    return reader.read_all().to_pandas(zero_copy_only=False, self_destruct=True)
+
+
+def _decode_pickle(payload: memoryview):
+    return pickle.loads(payload)
+
+
+_DECODERS = {
+    ARROW_TAG: _decode_arrow,
+    PICKLE_TAG: _decode_pickle,
+}
+
+
+def decode_dataframe(blob: bytes):
+    """Deserialize a blob produced by encode_dataframe, or a legacy pickle."""
+    view = memoryview(blob)
+    if view[:1] == _LEGACY_PICKLE:
+        return pickle.loads(view)
+    tag = bytes(view[:_TAG_SIZE])
+    decoder = _DECODERS.get(tag)
+    if decoder is None:
+        raise ValueError(f"Unknown blob format tag {tag!r}")
+    return decoder(view[_TAG_SIZE:])
+
+
+def _read_arrow_table(stream: io.BufferedIOBase) -> pa.Table:
+    return pa.ipc.open_stream(pa.PythonFile(stream, mode="r")).read_all()
+
+
+def _read_pickle_table(stream: io.BufferedIOBase) -> pa.Table:
+    return _table_from_frame(pickle.load(stream))
+
+
+_TABLE_READERS = {
+    ARROW_TAG: _read_arrow_table,
+    PICKLE_TAG: _read_pickle_table,
+}
+
+
+def read_table(stream: io.BufferedIOBase) -> pa.Table:
+    """
+    Deserialize a blob from a buffered binary stream into an Arrow table.
+
+    The stream is read incrementally, so the whole blob never has to be held
+    in memory as a single bytes object. Arrow blobs are returned without going
+    through pandas; pickled frames are unpickled and converted column by column.
+    """
+    if stream.peek(1)[:1] == _LEGACY_PICKLE:
+        return _read_pickle_table(stream)
+    tag = stream.read(_TAG_SIZE)
+    reader = _TABLE_READERS.get(tag)
+    if reader is None:
+        raise ValueError(f"Unknown blob format tag {tag!r}")
+    return reader(stream)
+
+
+def _table_from_frame(df) -> pa.Table:
+    # Pickled frames are the ones Table.from_pandas rejected, so build the
+    # table from individual columns (duplicate names are allowed there) and
+    # render columns Arrow can't type as strings
+    arrays = []
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        try:
+            arrays.append(pa.array(column, from_pandas=True))
+        except pa.ArrowException:
+            arrays.append(pa.array(column.astype(str)))
+    return pa.Table.from_arrays(arrays, names=[str(name) for name in df.columns])
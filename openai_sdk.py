@@ -1,103 +1,292 @@
+from __future__ import annotations
+
 import asyncio
-import json
+import hashlib
+import io
+import logging
 import os
 import sqlite3
-import pickle
-import pandas as pd
+import threading
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING
+import pyarrow as pa
 
-from agents import Agent, Runner
-from agents.mcp import MCPServer, MCPServerStdio
-from fire import Fire
-from dotenv import load_dotenv
-from mcp_handles_server.config import DB_PATH
+from mcp_handles_server.serialization import read_table
 
-load_dotenv()
+log = logging.getLogger(__name__)
 
-def fetch_dataframe(handle: str) -> pd.DataFrame:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.execute("SELECT dataframe FROM handles WHERE handle = ?", (handle,))
-    result = cursor.fetchone()
-    conn.close()
-    return pickle.loads(result[0]) if result else None
+# The agents SDK, pydantic and dotenv are imported where they are used, so importing
+# this module as a library does not pay for them
+if TYPE_CHECKING:
+    from agents.mcp import MCPServer, MCPServerStdio
 
-async def run(mcp_server: MCPServer, query: str):
-    agent = Agent(
-        name="Assistant",
-        instructions="""Use the tools to read the filesystem and answer questions based on those files. You will only receive and work with handles, never the actual data.
-        As a final result, you will only respond with JSON of the following form.
-        {
-            "handle": "The handle to the dataframe answering the question"
-        }
+# One connection to the handles database, opened on first use and reused for every lookup
+_CONN: sqlite3.Connection | None = None
+_CONN_LOCK = threading.Lock()
+# Fixed SQL text so every lookup hits the connection's prepared-statement cache
+FETCH_SQL = """
+    SELECT rowid, dataframe IS NULL, EXISTS(SELECT 1 FROM schemas WHERE schemas.handle = handles.handle)
+    FROM handles WHERE handle = ?
+"""
+SCHEMA_SQL = "SELECT column_name, dtype, num_rows FROM schemas WHERE handle = ? ORDER BY position"
+# Stored blobs are streamed to the decoder in chunks of this size
+_BLOB_CHUNK_SIZE = 64 * 1024
+
+class _BlobReader(io.RawIOBase):
+    """Read-only file object over an incremental SQLite BLOB handle."""
+
+    def __init__(self, blob: sqlite3.Blob):
+        self._blob = blob
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._blob.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def _get_conn() -> sqlite3.Connection:
+    global _CONN
+    with _CONN_LOCK:
+        if _CONN is None:
+            from mcp_handles_server.config import DB_PATH
+            c = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("PRAGMA temp_store=MEMORY")
+            c.execute("PRAGMA cache_size=-65536")
+            c.execute("PRAGMA mmap_size=268435456")
+            # Handles that answered earlier queries, keyed by a hash of the normalized query text
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS query_cache (
+                    query_hash TEXT PRIMARY KEY,
+                    handle TEXT,
+                    created_at INTEGER
+                )
+            """)
+            # Written by the server for schema handles; created here too so lookups
+            # also work on databases from servers that predate it
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS schemas (
+                    handle TEXT,
+                    position INTEGER,
+                    column_name TEXT,
+                    dtype TEXT,
+                    num_rows INTEGER,
+                    PRIMARY KEY (handle, position)
+                )
+            """)
+            _CONN = c
+    return _CONN
+
+# Handles are never rewritten once stored, so a decoded table stays valid for the
+# life of the process. Missing handles raise and are therefore not cached.
+@lru_cache(maxsize=32)
+def _cached_table(handle: str) -> pa.Table | None:
+    conn = _get_conn()
+    with _CONN_LOCK:
+        result = conn.execute(FETCH_SQL, (handle,)).fetchone()
+        if result is None:
+            raise KeyError(handle)
+        rowid, is_null, is_schema = result
+        if is_schema:
+            # Schema handles are rebuilt from their per-column rows; the blob is never read
+            rows = conn.execute(SCHEMA_SQL, (handle,)).fetchall()
+            columns, dtypes, num_rows = zip(*rows)
+            return pa.table({'column': columns, 'dtype': dtypes, 'num_rows': num_rows})
+        if is_null:
+            return None
+        # Decode straight from the BLOB instead of first copying it into a bytes object
+        with conn.blobopen("handles", "dataframe", rowid, readonly=True) as blob:
+            return read_table(io.BufferedReader(_BlobReader(blob), _BLOB_CHUNK_SIZE))
+
+def fetch_dataframe(handle: str) -> tuple[bool, pa.Table | None]:
+    """
+    Look up a handle in the handles table.
+
+    Returns (found, table); table is None when the handle exists but has no stored data.
+    """
+    try:
+        return True, _cached_table(handle)
+    except KeyError:
+        return False, None
+
+@lru_cache(maxsize=None)
+def _handle_result_model() -> type:
+    # Built on first use so importing this module does not import pydantic
+    from pydantic import BaseModel
+
+    class HandleResult(BaseModel):
+        """Final answer of the agent: a handle to the answering DataFrame, or why there is none."""
+        handle: str | None = None
+        error: str | None = None
 
-        OR
+    return HandleResult
 
-        {
-            "error": "The agent could not answer the question using the available tools, because <reason>."
-        }
+def _query_hash(query: str) -> str:
+    # Case and runs of whitespace don't distinguish queries
+    return hashlib.blake2b(" ".join(query.split()).lower().encode(), digest_size=16).hexdigest()
 
-        You will only respond with the JSON, nothing else (no markdown, no code blocks, no other text).
+def _cached_handle(query_hash: str) -> str | None:
+    conn = _get_conn()
+    with _CONN_LOCK:
+        result = conn.execute("SELECT handle FROM query_cache WHERE query_hash = ?", (query_hash,)).fetchone()
+    return result[0] if result else None
+
+def _cache_handle(query_hash: str, handle: str):
+    conn = _get_conn()
+    with _CONN_LOCK:
+        conn.execute(
+            "INSERT OR REPLACE INTO query_cache (query_hash, handle, created_at) VALUES (?, ?, ?)",
+            (query_hash, handle, int(time.time())),
+        )
+
+def _print_table(tbl: pa.Table | None):
+    if tbl is not None:
+        # Check if this is a schema result (has specific columns)
+        names = tbl.column_names
+        if len(names) == 3 and 'num_rows' in names and 'column' in names and 'dtype' in names:
+            print("\nDataFrame Schema:")
+            print(f"Number of rows: {tbl['num_rows'][0].as_py() if tbl.num_rows else 0}")
+            print("\nColumns:")
+            for column, dtype in zip(tbl['column'].to_pylist(), tbl['dtype'].to_pylist()):
+                print(f"- {column}: {dtype}")
+        else:
+            # to_pandas imports pandas on first use, so only this branch pays for it
+            print("\nDataFrame contents:")
+            print(tbl.to_pandas())
+    else:
+        print("Error: Could not load DataFrame from handle.")
+
+async def _show_handle(handle: str) -> bool:
+    """
+    Print the data behind a handle. Returns False if the handle is not in the database.
+    """
+    # Lookup and decoding run on a worker thread so the event loop keeps serving MCP traffic
+    found, tbl = await asyncio.to_thread(fetch_dataframe, handle)
+    if found:
+        _print_table(tbl)
+    return found
+
+async def run(mcp_server: MCPServer, query: str, use_cache: bool = True):
+    query_hash = _query_hash(query) if use_cache else None
+    if query_hash is not None:
+        # A repeated query is answered from the handle it resolved to last time,
+        # as long as that handle is still in the database
+        handle = await asyncio.to_thread(_cached_handle, query_hash)
+        if handle is not None and await _show_handle(handle):
+            return
+
+    from agents import Agent, Runner
+
+    HandleResult = _handle_result_model()
+    agent = Agent(
+        name="Assistant",
+        instructions="""Use the tools to read the filesystem and answer questions based on those files. You will only receive and work with handles, never the actual data.
+        As a final result, give the handle to the dataframe answering the question, or an error explaining why the question can't be answered using the available tools.
         """,
+        output_type=HandleResult,
         mcp_servers=[mcp_server],
     )
 
     result = await Runner.run(starting_agent=agent, input=query)
-    print("Agent responses:", result.raw_responses)
-
-    print(result.final_output)
+    # The raw responses hold every tool call payload; logging only formats them when debug is on
+    log.debug("Agent responses: %s", result.raw_responses)
+    log.debug("Final output: %s", result.final_output)
 
-
-    res = json.loads(result.final_output.strip())
-    if 'error' in res:
-        raise Exception(res['error'])
+    # The SDK validates the final output against HandleResult, so there is no text to parse
+    res = result.final_output_as(HandleResult)
+    if res.error:
+        raise Exception(res.error)
     try:
-        handle = res['handle']
+        handle = res.handle
         if not handle:
             print("Error: No handle was returned by the agent.")
             return
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.execute("SELECT EXISTS(SELECT 1 FROM handles WHERE handle = ?)", (handle,))
-        exists = cursor.fetchone()[0]
-        conn.close()
-
-        if not exists:
+        if not await _show_handle(handle):
             print(f"Error: Invalid handle '{handle}' - not found in database.")
             return
 
-        df = fetch_dataframe(handle)
-        if df is not None:
-            # Check if this is a schema result (has specific columns)
-            if set(df.columns) == {'column', 'dtype'} and 'num_rows' in df:
-                print("\nDataFrame Schema:")
-                print(f"Number of rows: {df['num_rows'].iloc[0]}")
-                print("\nColumns:")
-                for _, row in df.drop('num_rows', axis=1).iterrows():
-                    print(f"- {row['column']}: {row['dtype']}")
-            else:
-                print("\nDataFrame contents:")
-                print(df)
-        else:
-            print("Error: Could not load DataFrame from handle.")
+        if query_hash is not None:
+            await asyncio.to_thread(_cache_handle, query_hash, handle)
     except Exception as e:
         print(f"Error processing result: {str(e)}")
 
-async def main(query: str):
-    current_dir = os.path.dirname(os.path.abspath(__file__))
+def _handles_server() -> MCPServerStdio:
+    from agents.mcp import MCPServerStdio
 
-    async with MCPServerStdio(
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return MCPServerStdio(
         name="Filesystem Server, via uvx",
         params={
             "command": "uv",
             "cwd": current_dir,
             "args": ["run", "-m", "mcp_handles_server.df_abstractions"],
         },
-    ) as server:
-        await run(server, query)
+    )
+
+async def main(query: str, use_cache: bool = True):
+    # Open the handles database while the server subprocess is starting up
+    warm = asyncio.create_task(asyncio.to_thread(_get_conn))
+    try:
+        async with _handles_server() as server:
+            await warm
+            await run(server, query, use_cache)
+    finally:
+        # Settle the task even if the server failed to start, so its outcome is retrieved
+        warm.cancel()
+        await asyncio.gather(warm, return_exceptions=True)
+
+async def serve_main(use_cache: bool = True):
+    # One server subprocess answers every query read from stdin, so only the
+    # first query pays for its startup
+    warm = asyncio.create_task(asyncio.to_thread(_get_conn))
+    try:
+        async with _handles_server() as server:
+            await warm
+            while True:
+                try:
+                    query = await asyncio.to_thread(input, "> ")
+                except EOFError:
+                    break
+                if not query.strip():
+                    continue
+                try:
+                    await run(server, query, use_cache)
+                except Exception as e:
+                    print(f"Error: {e}")
+    finally:
+        warm.cancel()
+        await asyncio.gather(warm, return_exceptions=True)
 
-def entrypoint(query: str):
+def entrypoint(query: str = "", serve: bool = False, no_cache: bool = False, verbose: bool = False):
     """
-    Run the MCP server with the given query.
+    Run the MCP server with the given query, or with --serve answer queries read from stdin.
+    Repeated queries reuse the handle they resolved to before unless --no-cache is given.
+    --verbose also prints the agent's raw responses and final output.
     """
-    asyncio.run(main(query))
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(format="%(message)s")
+    if verbose:
+        log.setLevel(logging.DEBUG)
+    if serve:
+        asyncio.run(serve_main(not no_cache))
+    else:
+        asyncio.run(main(query, not no_cache))
 
 if __name__ == "__main__":
-    Fire(entrypoint)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Answer questions about the sample database through the MCP handles server.")
+    parser.add_argument("query", nargs="?", default="", help="The question to answer")
+    parser.add_argument("--serve", action="store_true", help="Keep the server running and answer queries read from stdin")
+    parser.add_argument("--no-cache", action="store_true", help="Always ask the agent, even for a query answered before")
+    parser.add_argument("--verbose", action="store_true", help="Print the agent's raw responses and final output")
+    args = parser.parse_args()
+    if not args.serve and not args.query:
+        parser.error("a query is required unless --serve is given")
+    entrypoint(args.query, serve=args.serve, no_cache=args.no_cache, verbose=args.verbose)